@@ -1,40 +1,92 @@
 import logging  # Будем вести лог
 from datetime import datetime, timezone
 from zoneinfo import ZoneInfo  # ВременнАя зона
-from typing import Any  # Любой тип
+from typing import Any, NamedTuple  # Любой тип, именованный кортеж
+from functools import lru_cache  # Кэш результатов
+import itertools  # Бесконечный счетчик частей токена
 from uuid import uuid4  # Номера подписок должны быть уникальными во времени и пространстве
-from json import loads, JSONDecodeError, dumps  # Сервер WebSockets работает с JSON сообщениями
-from threading import Thread  # Подписки сервера WebSockets будем получать в отдельном потоке
-
+from threading import Thread, current_thread  # Цикл событий подписок сервера WebSockets будем выполнять в отдельном потоке
+from concurrent.futures import ThreadPoolExecutor  # Обработчики событий подписок вызываем в отдельном потоке
+import asyncio  # Все подписки сервера WebSockets обслуживаем в одном цикле событий
+import sys  # Определение операционной системы
+import os  # Переменные окружения
+import io  # Чтение токена частями в буфер
+import time  # Монотонное время для проверки срока действия токена доступа
+
+from orjson import loads, JSONDecodeError, dumps  # Сервер WebSockets работает с JSON сообщениями. Быстрое кодирование/декодирование JSON
+import numpy as np  # Массивы даты и времени
+import ijson  # Потоковый разбор больших ответов JSON
 import keyring  # Безопасное хранение торгового токена
 import keyring.errors  # Ошибки хранилища
-from requests import post, get, Response  # Запросы/ответы через HTTP API
-from urllib3.exceptions import SSLError  # Ошибка SSL
-from websockets.sync.client import connect, ClientConnection  # Подключение к серверу WebSockets в синхронном режиме
+from requests import Session, Response  # Запросы/ответы через HTTP API
+import aiohttp  # Асинхронные запросы/ответы через HTTP API
+from requests.adapters import HTTPAdapter  # Адаптер соединений HTTP API с повторными попытками
+from requests.exceptions import RequestException  # Ошибки запросов HTTP API
+from urllib3.util import Retry  # Политика повторных попыток запросов
+from websockets.asyncio.client import connect, ClientConnection  # Подключение к серверу WebSockets в асинхронном режиме
 from websockets.exceptions import ConnectionClosed  # Событие закрытия соединения сервера WebSockets
+if sys.platform != 'win32':  # uvloop работает только в POSIX системах
+    try:
+        import uvloop  # Быстрый цикл событий
+    except ImportError:  # Если uvloop не установлен. Например, в PyPy или для новой версии Python еще нет сборки
+        uvloop = None  # то используем стандартный цикл событий asyncio
+else:  # В Windows
+    uvloop = None  # используем стандартный цикл событий asyncio
 
 
 class BCSPy:
     """Работа с БКС торговое API https://trade-api.bcs.ru из Python"""
     tz_msk = ZoneInfo('Europe/Moscow')  # Время UTC будем приводить к московскому времени
+    _msk_offset = tz_msk.utcoffset(datetime(2020, 1, 1))  # Смещение московского времени от UTC. С 26.10.2014 постоянное, без перехода на летнее время
+    _msk_fixed_since = datetime(2014, 10, 26, 2)  # Московское время, начиная с которого смещение постоянное
+    _utc_fixed_since = _msk_fixed_since - _msk_offset  # Время UTC, начиная с которого смещение постоянное
     http_server = 'https://be.broker.ru'  # Сервер запросов
     ws_server = 'wss://ws.broker.ru'  # Сервер подписок WebSocket
     logger = logging.getLogger('BCSPy')  # Будем вести лог
 
+    # Адреса запросов и подписок. Формируем один раз при создании класса
+    _url_token = f'{http_server}/trade-api-keycloak/realms/tradeapi/protocol/openid-connect/token'  # Получение токена доступа
+    _url_limits = f'{http_server}/trade-api-bff-limit/api/v1/limits'  # Лимиты
+    _uri_limits = f'{ws_server}/trade-api-bff-limit/api/v1/limits/ws'  # Подписка на лимиты
+    _url_portfolio = f'{http_server}/trade-api-bff-portfolio/api/v1/portfolio'  # Портфель
+    _uri_portfolio = f'{ws_server}/trade-api-bff-portfolio/api/v1/portfolio/ws'  # Подписка на портфель
+    _url_orders = f'{http_server}/trade-api-bff-operations/api/v1/orders'  # Заявки
+    _uri_executions = f'{ws_server}/trade-api-bff-operations/api/v1/orders/execution/ws'  # Подписка на исполненные заявки
+    _uri_transactions = f'{ws_server}/trade-api-bff-operations/api/v1/orders/transaction/ws'  # Подписка на обновления о статусе созданных заявок
+    _url_candles_chart = f'{http_server}/trade-api-market-data-connector/api/v1/candles-chart'  # Исторические свечи
+    _uri_market_data = f'{ws_server}/trade-api-market-data-connector/api/v1/market-data/ws'  # Подписка на рыночные данные
+    _url_instruments_by_tickers = f'{http_server}/trade-api-information-service/api/v1/instruments/by-tickers'  # Поиск инструмента по тикеру
+    _url_instruments_by_type = f'{http_server}/trade-api-information-service/api/v1/instruments/by-type'  # Поиск инструмента по типу инструмента
+    _url_daily_schedule = f'{http_server}/trade-api-information-service/api/v1/trading-schedule/daily-schedule'  # Расписание инструмента
+    _url_trading_status = f'{http_server}/trade-api-information-service/api/v1/trading-schedule/status'  # Торговый статус инструмента
+    _uri_margins = f'{ws_server}/trade-api-bff-marginal-indicators/api/v1/marginal-indicators/ws'  # Подписка на маржинальные показатели портфеля
+    _url_instruments_discounts = f'{http_server}/trade-api-bff-marginal-indicators/api/v1/instruments-discounts'  # Дисконты
+
+    # Атрибуты экземпляра храним в слотах, а не в словаре. Меньше памяти и быстрее доступ
+    __slots__ = ('_loop', '_loop_thread', '_tasks', '_callback_executor', '_callback_thread',  # Подписки WebSockets
+                 'ws_limits', 'ws_portfolio', 'ws_executions', 'ws_transactions', 'ws_market_data', 'ws_margins',  # Соединения WebSockets
+                 'on_limit', 'on_portfolio', 'on_execution', 'on_transaction', 'on_quote', 'on_candle', 'on_order_book', 'on_trade', 'on_margin',  # События
+                 '_md_dispatch', '_md_subscriptions',  # Рыночные данные
+                 'refresh_token', '_dataname_cache', '_http', '_http_loop', '_token_lock', '_session', 'access_token', 'access_token_expired', '_cached_headers')  # Запросы
+
     def __init__(self, refresh_token=None):
         """Инициализация
 
         :param str refresh_token: Токен
         """
+        # Подписки WebSockets
+        self._loop: asyncio.AbstractEventLoop | None = None  # Цикл событий, в котором работают все подписки. Запускается при первой подписке
+        self._loop_thread: Thread | None = None  # Поток цикла событий
+        self._tasks: set[asyncio.Task] = set()  # Задачи подписок. Храним ссылки, чтобы задачи не были удалены сборщиком мусора
+        self._callback_executor: ThreadPoolExecutor | None = None  # Исполнитель обработчиков событий
+        self._callback_thread: Thread | None = None  # Поток обработчиков событий
+
         # Соединения WebSockets
         self.ws_limits: ClientConnection | None = None  # Лимиты
         self.ws_portfolio: ClientConnection | None = None  # Портфель
         self.ws_executions: ClientConnection | None = None  # Исполненные заявки
         self.ws_transactions: ClientConnection | None = None  # Обновления о статусе созданных заявок
-        self.ws_quotes: ClientConnection | None = None  # Котировки
-        self.ws_last_candle: ClientConnection | None = None  # Последние свечи
-        self.ws_order_book: ClientConnection | None = None  # Стакан
-        self.ws_trades: ClientConnection | None = None  # Обезличенные сделки
+        self.ws_market_data: ClientConnection | None = None  # Рыночные данные: котировки, последние свечи, стакан, обезличенные сделки
         self.ws_margins: ClientConnection | None = None  # Маржинальные показатели портфеля
 
         # События
@@ -48,6 +100,10 @@ class BCSPy:
         self.on_trade = Event()  # Обезличенные сделки
         self.on_margin = Event()  # Маржинальные показатели портфеля
 
+        # Рыночные данные приходят по одному соединению. Событие выбираем по типу данных
+        self._md_dispatch: dict[int, Event] = {0: self.on_order_book, 1: self.on_candle, 2: self.on_trade, 3: self.on_quote}  # Тип данных -> Событие
+        self._md_subscriptions: dict[int, list[dict]] = {}  # Тип данных -> Запросы действующих подписок
+
         if refresh_token is None:  # Если токен не указан
             self.refresh_token = self.get_long_token_from_keyring('BCSPy', 'refresh_token')  # то получаем его из защищенного хранилища по частям
             if self.refresh_token is None:  # Если токен не найден
@@ -56,85 +112,103 @@ class BCSPy:
             self.refresh_token = refresh_token  # то запоминаем токен
             self.set_long_token_to_keyring('BCSPy', 'refresh_token', self.refresh_token)  # Сохраняем его в защищенное хранилище
 
+        self._dataname_cache = lru_cache(maxsize=1024)(self._get_class_code_ticker)  # Коды режимов торгов и тикеры по названиям тикеров запоминаем, т.к. в течение дня они не меняются
+        self._http: aiohttp.ClientSession | None = None  # Сессия асинхронных запросов. Создается при первом запросе в цикле событий вызывающего кода
+        self._http_loop: asyncio.AbstractEventLoop | None = None  # Цикл событий, в котором создана сессия асинхронных запросов
+        self._token_lock: asyncio.Lock | None = None  # Блокировка получения токена доступа асинхронными запросами. Создается вместе с сессией, т.к. привязана к ее циклу событий
+        self._session = Session()  # Сессия запросов. Соединения с сервером запросов используются повторно
+        self._session.mount('https://', HTTPAdapter(max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=(502, 503, 504), allowed_methods=frozenset(('GET', 'POST')), raise_on_status=False)))  # При ошибках соединения и временной недоступности сервера повторяем запрос до 3-х раз с нарастающей задержкой
+        self._session.mount(self._url_orders, HTTPAdapter(max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=(502, 503, 504), allowed_methods=frozenset(('GET',)), raise_on_status=False)))  # Заявки (POST) повторяем только при ошибке соединения. Если сервер мог принять заявку, то повтор выставил бы ее еще раз
         self.access_token = None  # Токен доступа
-        self.access_token_expired = 0  # UNIX время в секундах окончания срока действия токена доступа
+        self.access_token_expired = 0.0  # Монотонное время в секундах окончания срока действия токена доступа
+        self._cached_headers: dict[str, str] = {}  # Хедеры для запросов с текущим токеном доступа
 
     def __enter__(self):
         """Вход в класс, например, с with"""
         return self
 
+    async def __aenter__(self):
+        """Вход в класс, например, с async with"""
+        return self
+
     # Авторизация
 
     def get_access_token(self) -> str | None:  # https://trade-api.bcs.ru/authorization
         """Получение токена доступа
         :return: Токен доступа
         """
-        now = int(datetime.timestamp(datetime.now()))  # Текущая дата и время в виде UNIX времени в секундах
+        now = time.monotonic()  # Текущее монотонное время в секундах. Не зависит от перевода системных часов
         if self.access_token is None or now >= self.access_token_expired:  # Если токен доступа не был выдан или был просрочен
             try:
-                response = post(url=f'{self.http_server}/trade-api-keycloak/realms/tradeapi/protocol/openid-connect/token',  # Запрашиваем новый токен доступа
-                                data={'client_id': 'trade-api-write',  # Токен для торговли
-                                      'grant_type': 'refresh_token',  # Токен доступа будет получать через токен
-                                      'refresh_token': self.refresh_token})  # Токен
-            except SSLError:  # Ошибка соединения SSL
-                self.logger.error('Ошибка соединения SSL')  # Событие ошибки
+                response = self._session.post(url=self._url_token,  # Запрашиваем новый токен доступа
+                                              data={'client_id': 'trade-api-write',  # Токен для торговли
+                                                    'grant_type': 'refresh_token',  # Токен доступа будет получать через токен
+                                                    'refresh_token': self.refresh_token})  # Токен
+            except RequestException as ex:  # Если запрос не выполнен после всех повторных попыток
+                self.logger.error(f'Ошибка запроса токена доступа: {ex}')  # Событие ошибки
                 self.access_token = None  # Сбрасываем токен доступа
-                self.access_token_expired = 0  # Сбрасываем время окончания срока действия токена доступа
+                self.access_token_expired = 0.0  # Сбрасываем время окончания срока действия токена доступа
                 return None
             if response.status_code != 200:  # Если при получении токена возникла ошибка
                 self.logger.error(f'Ошибка получения JWT токена: {response.status_code}')  # Событие ошибки
                 self.access_token = None  # Сбрасываем токен доступа
-                self.access_token_expired = 0  # Сбрасываем время окончания срока действия токена доступа
+                self.access_token_expired = 0.0  # Сбрасываем время окончания срока действия токена доступа
                 return None
             # Токен получен
             access_token = response.json()  # Читаем данные JSON
             self.access_token = access_token['access_token']  # Получаем токен доступа
-            self.access_token_expired = now + int(access_token['expires_in'])  # Получаем время окончания срока действия токена доступа. Ставим его на 5 секунд раньше, чтобы исключить просрочку
+            self.access_token_expired = now + int(access_token['expires_in']) - 5  # Получаем время окончания срока действия токена доступа. Ставим его на 5 секунд раньше, чтобы исключить просрочку
         return self.access_token
 
     # Получение информации о вашем портфеле через сервис «Лимиты» https://trade-api.bcs.ru/limits
 
     def get_limits(self):
         """Получение информации о портфеле через Лимиты"""
-        return self._check_result(get(url=f'{self.http_server}/trade-api-bff-limit/api/v1/limits', headers=self._get_headers()))
+        return self._check_result(self._session.get(url=self._url_limits, headers=self._get_headers()))
+
+    async def get_limits_async(self):
+        """Получение информации о портфеле через Лимиты. Асинхронно"""
+        return await self._request_async('GET', self._url_limits)
 
     def subscribe_limits(self):
         """Подписка на Лимиты"""
         if self.ws_limits is None:  # Если не подписаны
             self.logger.debug('Подписка на Лимиты')
-            self.ws_limits = connect(uri=f'{self.ws_server}/trade-api-bff-limit/api/v1/limits/ws', additional_headers=self._get_headers())  # Подключаемся к сервису WebSockets
-            Thread(target=self._subscribe_thread, args=('Limits', self.ws_limits, self.on_limit), name='LimitsThread').start()  # Создаем и запускаем поток
+            self.ws_limits = self._connect(self._uri_limits, 'Limits', self.on_limit)  # Подключаемся к сервису WebSockets, запускаем задачу подписки
 
     def unsubscribe_limits(self):
         """Отмена подписки на Лимиты"""
         if self.ws_limits is not None:  # Если подписаны
             self.logger.debug('Отмена подписки на Лимиты')
-            self.ws_limits.close()  # то закрваем соединение
+            self._run(self.ws_limits.close())  # то закрваем соединение
             self.ws_limits = None  # Сбрасываем подключение
 
     # Получение информации о вашем портфеле через сервис «Портфель» https://trade-api.bcs.ru/portfolio
 
     def get_portfolio(self):
         """Получение информации о вашем портфеле через сервис «Портфель»"""
-        return self._check_result(get(url=f'{self.http_server}/trade-api-bff-portfolio/api/v1/portfolio', headers=self._get_headers()))
+        return self._check_result(self._session.get(url=self._url_portfolio, headers=self._get_headers()))
+
+    async def get_portfolio_async(self):
+        """Получение информации о вашем портфеле через сервис «Портфель». Асинхронно"""
+        return await self._request_async('GET', self._url_portfolio)
 
     def subscribe_portfolio(self):
         """Подписка на Портфель"""
         if self.ws_portfolio is None:  # Если не подписаны
             self.logger.debug('Подписка на Портфель')
-            self.ws_portfolio = connect(uri=f'{self.ws_server}/trade-api-bff-portfolio/api/v1/portfolio/ws', additional_headers=self._get_headers())  # Подключаемся к сервису WebSockets
-            Thread(target=self._subscribe_thread, args=('Portfolio', self.ws_portfolio, self.on_portfolio), name='PortfolioThread').start()  # Создаем и запускаем поток
+            self.ws_portfolio = self._connect(self._uri_portfolio, 'Portfolio', self.on_portfolio)  # Подключаемся к сервису WebSockets, запускаем задачу подписки
 
     def unsubscribe_portfolio(self):
         """Отмена подписки на Портфель"""
         if self.ws_portfolio is not None:  # Если подписаны
             self.logger.debug('Отмена подписки на Портфель')
-            self.ws_portfolio.close()  # то закрваем соединение
+            self._run(self.ws_portfolio.close())  # то закрваем соединение
             self.ws_portfolio = None  # Сбрасываем подключение
 
     # Заявки https://trade-api.bcs.ru/operations
 
-    def create_order(self, side: int, order_type: int, order_quantity: int, ticker: str, class_code: str, price: float = None, client_order_id: str = str(uuid4())):  # https://trade-api.bcs.ru/operations/create
+    def create_order(self, side: int, order_type: int, order_quantity: int, ticker: str, class_code: str, price: float = None, client_order_id: str | None = None):  # https://trade-api.bcs.ru/operations/create
         """Создание торговой заявки
 
         :param int side: Сторона заявки (1 - покупка, 2 - продажа)
@@ -143,40 +217,77 @@ class BCSPy:
         :param str ticker: Тикер
         :param str class_code: Режим торгов
         :param float price: Цена для лимитной заявки (> 0). Допустимо 8 знаков после запятой
-        :param str client_order_id: Идентификатор заявки
+        :param str client_order_id: Идентификатор заявки. Если не указан, то будет создан новый
         """
+        params = self._create_order_params(side, order_type, order_quantity, ticker, class_code, price, client_order_id)
+        return self._check_result(self._session.post(url=self._url_orders, json=params, headers=self._get_headers()))
+
+    async def create_order_async(self, side: int, order_type: int, order_quantity: int, ticker: str, class_code: str, price: float = None, client_order_id: str | None = None):
+        """Создание торговой заявки. Асинхронно. Параметры как у create_order"""
+        params = self._create_order_params(side, order_type, order_quantity, ticker, class_code, price, client_order_id)
+        return await self._request_async('POST', self._url_orders, json=params)
+
+    @staticmethod
+    def _create_order_params(side: int, order_type: int, order_quantity: int, ticker: str, class_code: str, price: float | None, client_order_id: str | None) -> dict:
+        """Параметры создания торговой заявки. Параметры как у create_order"""
+        if client_order_id is None:  # Если идентификатор заявки не указан
+            client_order_id = str(uuid4())  # то создаем новый уникальный идентификатор
         params = {'clientOrderId': client_order_id, 'side': side, 'orderType': order_type, 'orderQuantity': order_quantity, 'ticker': ticker, 'classCode': class_code}
         if order_type == 2:  # Для лимитной заявки
             params['price'] = price  # указываем цену
-        return self._check_result(post(url=f'{self.http_server}/trade-api-bff-operations/api/v1/orders', json=params, headers=self._get_headers()))
+        return params
 
-    def cancel_order(self, original_client_order_id: str, client_order_id: str = str(uuid4())):  # https://trade-api.bcs.ru/operations/cancel
+    def cancel_order(self, original_client_order_id: str, client_order_id: str | None = None):  # https://trade-api.bcs.ru/operations/cancel
         """Отмена заявки
 
         :param str original_client_order_id: Идентификатор заменяемой заявки. Идентификатор запроса на выставление заявки (id исходного запроса)
-        :param str client_order_id: Новый идентификатор для отмены
+        :param str client_order_id: Новый идентификатор для отмены. Если не указан, то будет создан новый
         """
-        params = {'clientOrderId': client_order_id}
-        return self._check_result(post(url=f'{self.http_server}/trade-api-bff-operations/api/v1/orders/{original_client_order_id}/cancel', json=params, headers=self._get_headers()))
+        params = self._client_order_id_params(client_order_id)
+        return self._check_result(self._session.post(url=f'{self._url_orders}/{original_client_order_id}/cancel', json=params, headers=self._get_headers()))
+
+    async def cancel_order_async(self, original_client_order_id: str, client_order_id: str | None = None):
+        """Отмена заявки. Асинхронно. Параметры как у cancel_order"""
+        params = self._client_order_id_params(client_order_id)
+        return await self._request_async('POST', f'{self._url_orders}/{original_client_order_id}/cancel', json=params)
 
-    def edit_order(self, original_client_order_id: str, price: float, order_quantity: int, class_code: str, client_order_id: str = str(uuid4())):  # https://trade-api.bcs.ru/operations/edit
+    def edit_order(self, original_client_order_id: str, price: float, order_quantity: int, class_code: str, client_order_id: str | None = None):  # https://trade-api.bcs.ru/operations/edit
         """Изменение заявки
 
         :param str original_client_order_id: Идентификатор заменяемой заявки
         :param float price: Цена (> 0). Допустимо 8 знаков после запятой
         :param int order_quantity: Количество в заявке (шт.), > 0
         :param str class_code: Режим торгов
-        :param str client_order_id: Идентификатор новой заявки
+        :param str client_order_id: Идентификатор новой заявки. Если не указан, то будет создан новый
         """
-        params = {'clientOrderId': client_order_id, 'price': price, 'orderQuantity': order_quantity, 'classCode': class_code}
-        return self._check_result(post(url=f'{self.http_server}/trade-api-bff-operations/api/v1/orders/{original_client_order_id}', json=params, headers=self._get_headers()))
+        params = {**self._client_order_id_params(client_order_id), 'price': price, 'orderQuantity': order_quantity, 'classCode': class_code}
+        return self._check_result(self._session.post(url=f'{self._url_orders}/{original_client_order_id}', json=params, headers=self._get_headers()))
+
+    async def edit_order_async(self, original_client_order_id: str, price: float, order_quantity: int, class_code: str, client_order_id: str | None = None):
+        """Изменение заявки. Асинхронно. Параметры как у edit_order"""
+        params = {**self._client_order_id_params(client_order_id), 'price': price, 'orderQuantity': order_quantity, 'classCode': class_code}
+        return await self._request_async('POST', f'{self._url_orders}/{original_client_order_id}', json=params)
+
+    @staticmethod
+    def _client_order_id_params(client_order_id: str | None) -> dict:
+        """Параметры с идентификатором заявки для отмены и изменения заявки
+
+        :param str client_order_id: Идентификатор заявки. Если не указан, то будет создан новый
+        """
+        if client_order_id is None:  # Если идентификатор заявки не указан
+            client_order_id = str(uuid4())  # то создаем новый уникальный идентификатор
+        return {'clientOrderId': client_order_id}
 
     def get_order(self, original_client_order_id: str):  # https://trade-api.bcs.ru/operations/status
         """Получение статуса заявки
 
         :param str original_client_order_id: Идентификатор заявки
         """
-        return self._check_result(get(url=f'{self.http_server}/trade-api-bff-operations/api/v1/orders/{original_client_order_id}', headers=self._get_headers()))
+        return self._check_result(self._session.get(url=f'{self._url_orders}/{original_client_order_id}', headers=self._get_headers()))
+
+    async def get_order_async(self, original_client_order_id: str):
+        """Получение статуса заявки. Асинхронно. Параметры как у get_order"""
+        return await self._request_async('GET', f'{self._url_orders}/{original_client_order_id}')
 
     # Получение информации об исполненных заявках https://trade-api.bcs.ru/operations/execution
 
@@ -184,14 +295,13 @@ class BCSPy:
         """Подписка на исполненные заявки"""
         if self.ws_executions is None:  # Если не подписаны
             self.logger.debug('Подписка на исполненные заявки')
-            self.ws_executions = connect(uri=f'{self.ws_server}/trade-api-bff-operations/api/v1/orders/execution/ws', additional_headers=self._get_headers())  # Подключаемся к сервису WebSockets
-            Thread(target=self._subscribe_thread, args=('Executions', self.ws_executions, self.on_execution), name='ExecutionsThread').start()  # Создаем и запускаем поток
+            self.ws_executions = self._connect(self._uri_executions, 'Executions', self.on_execution)  # Подключаемся к сервису WebSockets, запускаем задачу подписки
 
     def unsubscribe_executions(self):
         """Отмена подписки на исполненные заявки"""
         if self.ws_executions is not None:  # Если подписаны
             self.logger.debug('Отмена подписки на исполненные заявки')
-            self.ws_executions.close()  # то закрваем соединение
+            self._run(self.ws_executions.close())  # то закрваем соединение
             self.ws_executions = None  # Сбрасываем подключение
 
     # Получение обновлений о статусе созданных заявок https://trade-api.bcs.ru/operations/transaction-status
@@ -200,14 +310,13 @@ class BCSPy:
         """Подписка на обновления о статусе созданных заявок"""
         if self.ws_transactions is None:  # Если не подписаны
             self.logger.debug('Подписка на обновления о статусе созданных заявок')
-            self.ws_transactions = connect(uri=f'{self.ws_server}/trade-api-bff-operations/api/v1/orders/transaction/ws', additional_headers=self._get_headers())  # Подключаемся к сервису WebSockets
-            Thread(target=self._subscribe_thread, args=('Transactions', self.ws_transactions, self.on_transaction), name='TransactionsThread').start()  # Создаем и запускаем поток
+            self.ws_transactions = self._connect(self._uri_transactions, 'Transactions', self.on_transaction)  # Подключаемся к сервису WebSockets, запускаем задачу подписки
 
     def unsubscribe_transactions(self):
         """Отмена подписки на обновления о статусе созданных заявок"""
         if self.ws_transactions is not None:  # Если подписаны
             self.logger.debug('Отмена подписки на обновления о статусе созданных заявок')
-            self.ws_transactions.close()  # то закрваем соединение
+            self._run(self.ws_transactions.close())  # то закрваем соединение
             self.ws_transactions = None  # Сбрасываем подключение
 
     # Рыночные данные https://trade-api.bcs.ru/market-data
@@ -218,21 +327,17 @@ class BCSPy:
         """Подписка на котировки
 
         :param int subscribe_type: 0 - подписка, 1 - отмена подписки
-        :param list[dict[str, str]] instruments: Список инструментов. instruments = [{'classCode': 'TQBR', 'ticker': 'SBER'}, {'classCode': 'SPBFUT', 'ticker': 'CNYRUBF'}]
+        :param list[dict[str, str]] instruments: Список инструментов. Все инструменты передаются одним запросом, поэтому несколько инструментов лучше подписывать одним вызовом. instruments = [{'classCode': 'TQBR', 'ticker': 'SBER'}, {'classCode': 'SPBFUT', 'ticker': 'CNYRUBF'}]
         """
-        if self.ws_quotes is None:  # Если не подписаны
-            self.ws_quotes = connect(uri=f'{self.ws_server}/trade-api-market-data-connector/api/v1/market-data/ws', additional_headers=self._get_headers())  # Подключаемся к сервису WebSockets
-            Thread(target=self._subscribe_thread, args=('Quotes', self.ws_quotes, self.on_quote), name='QuotesThread').start()  # Создаем и запускаем поток
         request = {'subscribeType': subscribe_type, 'dataType': 3, 'instruments': instruments}  # Формируем запрос
-        self.logger.debug(f'Подписка на котировки: {request}')
-        self.ws_quotes.send(dumps(request))  # Переводим JSON в строку, отправляем запрос
+        self.logger.debug('Подписка на котировки: %s', request)
+        self._send_market_data(request)  # Отправляем запрос
 
     def unsubscribe_quotes(self):
         """Отмена подписки на котировки"""
-        if self.ws_quotes is not None:  # Если подписаны
+        if self._md_subscriptions.get(3):  # Если подписаны
             self.logger.debug('Отмена подписки на котировки')
-            self.ws_quotes.close()  # то закрваем соединение
-            self.ws_quotes = None  # Сбрасываем подключение
+            self._unsubscribe_market_data(3)  # то отменяем все подписки этого типа данных
 
     # Последняя свеча https://trade-api.bcs.ru/market-data/last-candle
 
@@ -240,22 +345,18 @@ class BCSPy:
         """Подписка на последние свечи
 
         :param int subscribe_type: 0 - подписка, 1 - отмена подписки
-        :param list[dict[str, str]] instruments: Список инструментов. instruments = [{'classCode': 'TQBR', 'ticker': 'SBER'}, {'classCode': 'SPBFUT', 'ticker': 'CNYRUBF'}]
+        :param list[dict[str, str]] instruments: Список инструментов. Все инструменты передаются одним запросом, поэтому несколько инструментов лучше подписывать одним вызовом. instruments = [{'classCode': 'TQBR', 'ticker': 'SBER'}, {'classCode': 'SPBFUT', 'ticker': 'CNYRUBF'}]
         :param str time_frame: Временной интервал (M1, M2, ... M60)
         """
-        if self.ws_last_candle is None:  # Если не подписаны
-            self.ws_last_candle = connect(uri=f'{self.ws_server}/trade-api-market-data-connector/api/v1/market-data/ws', additional_headers=self._get_headers())  # Подключаемся к сервису WebSockets
-            Thread(target=self._subscribe_thread, args=('LastCandles', self.ws_last_candle, self.on_candle), name='LastCandlesThread').start()  # Создаем и запускаем поток
         request = {'subscribeType': subscribe_type, 'dataType': 1, 'instruments': instruments, 'timeFrame': time_frame}  # Формируем запрос
-        self.logger.debug(f'Подписка на последние свечи: {request}')
-        self.ws_last_candle.send(dumps(request))  # Переводим JSON в строку, отправляем запрос
+        self.logger.debug('Подписка на последние свечи: %s', request)
+        self._send_market_data(request)  # Отправляем запрос
 
     def unsubscribe_last_candles(self):
         """Отмена подписки на последние свечи"""
-        if self.ws_last_candle is not None:  # Если подписаны
+        if self._md_subscriptions.get(1):  # Если подписаны
             self.logger.debug('Отмена подписки на последние свечи')
-            self.ws_last_candle.close()  # то закрваем соединение
-            self.ws_last_candle = None  # Сбрасываем подключение
+            self._unsubscribe_market_data(1)  # то отменяем все подписки этого типа данных
 
     def get_candles_chart(self, class_code: str, ticker: str, start_date: datetime, end_date: datetime, time_frame: str):  # https://trade-api.bcs.ru/market-data/candles
         """Исторические свечи
@@ -266,8 +367,58 @@ class BCSPy:
         :param datetime end_date: Время окончания периода
         :param str time_frame: Временной интервал (M1, M5, M15, M30, H1, H4, D, W, MN)
         """
-        params = {'classCode': class_code, 'ticker': ticker, 'startDate': start_date.isoformat(), 'endDate': end_date.isoformat(), 'timeFrame': time_frame}
-        return self._check_result(get(url=f'{self.http_server}/trade-api-market-data-connector/api/v1/candles-chart', params=params, headers=self._get_headers()))
+        params = self._candles_chart_params(class_code, ticker, start_date, end_date, time_frame)
+        return self._check_result(self._session.get(url=self._url_candles_chart, params=params, headers=self._get_headers()))
+
+    async def get_candles_chart_async(self, class_code: str, ticker: str, start_date: datetime, end_date: datetime, time_frame: str):
+        """Исторические свечи. Асинхронно. Параметры как у get_candles_chart"""
+        params = self._candles_chart_params(class_code, ticker, start_date, end_date, time_frame)
+        return await self._request_async('GET', self._url_candles_chart, params=params)
+
+    @staticmethod
+    def _candles_chart_params(class_code: str, ticker: str, start_date: datetime, end_date: datetime, time_frame: str) -> dict:
+        """Параметры запроса исторических свечей. Параметры как у get_candles_chart"""
+        return {'classCode': class_code, 'ticker': ticker, 'startDate': start_date.isoformat(), 'endDate': end_date.isoformat(), 'timeFrame': time_frame}
+
+    def get_candles_chart_arrays(self, class_code: str, ticker: str, start_date: datetime, end_date: datetime, time_frame: str) -> 'Candles | None':
+        """Исторические свечи в виде массивов NumPy по каждому полю
+
+        :param str class_code: Режим торгов
+        :param str ticker: Тикер
+        :param datetime start_date: Время начала периода
+        :param datetime end_date: Время окончания периода
+        :param str time_frame: Временной интервал (M1, M5, M15, M30, H1, H4, D, W, MN)
+        :return: Свечи или None в случае ошибки
+        """
+        result = self.get_candles_chart(class_code, ticker, start_date, end_date, time_frame)  # Получаем свечи
+        if not isinstance(result, dict):  # Если при получении свечей возникла ошибка
+            return None  # то свечей нет
+        candles = result.get('candles', [])  # Список свечей
+        count = len(candles)  # Кол-во свечей. Размер массивов задаем заранее
+        return Candles(time=np.fromiter((candle['time'].rstrip('Z') for candle in candles), dtype='datetime64[s]', count=count),  # Время UTC без указания временнОй зоны
+                       open=np.fromiter((candle['open'] for candle in candles), dtype=np.float64, count=count),
+                       high=np.fromiter((candle['high'] for candle in candles), dtype=np.float64, count=count),
+                       low=np.fromiter((candle['low'] for candle in candles), dtype=np.float64, count=count),
+                       close=np.fromiter((candle['close'] for candle in candles), dtype=np.float64, count=count),
+                       volume=np.fromiter((candle['volume'] for candle in candles), dtype=np.float64, count=count))
+
+    def get_candles_chart_iter(self, class_code: str, ticker: str, start_date: datetime, end_date: datetime, time_frame: str):
+        """Исторические свечи по одной. Ответ разбирается по мере получения, без загрузки в память целиком
+
+        :param str class_code: Режим торгов
+        :param str ticker: Тикер
+        :param datetime start_date: Время начала периода
+        :param datetime end_date: Время окончания периода
+        :param str time_frame: Временной интервал (M1, M5, M15, M30, H1, H4, D, W, MN)
+        :return: Итератор свечей
+        """
+        params = self._candles_chart_params(class_code, ticker, start_date, end_date, time_frame)
+        with self._session.get(url=self._url_candles_chart, params=params, headers=self._get_headers(), stream=True) as response:  # Получаем ответ частями
+            if response.status_code != 200:  # Если статус ошибки
+                self.logger.error(f'Ошибка запроса: {response.status_code} Запрос: {response.request.path_url} Ответ: {response.text}')  # Событие ошибки
+                return  # Свечей нет
+            response.raw.decode_content = True  # Если ответ сжат, то распаковываем его при чтении
+            yield from ijson.items(response.raw, 'candles.item', use_float=True)  # Возвращаем свечи по мере разбора. Числа как float, а не Decimal
 
     # Стакан https://trade-api.bcs.ru/market-data/order-book
 
@@ -275,22 +426,18 @@ class BCSPy:
         """Подписка на стакан
 
         :param int subscribe_type: 0 - подписка, 1 - отмена подписки
-        :param list[dict[str, str]] instruments: Список инструментов. instruments = [{'classCode': 'TQBR', 'ticker': 'SBER'}, {'classCode': 'SPBFUT', 'ticker': 'CNYRUBF'}]
+        :param list[dict[str, str]] instruments: Список инструментов. Все инструменты передаются одним запросом, поэтому несколько инструментов лучше подписывать одним вызовом. instruments = [{'classCode': 'TQBR', 'ticker': 'SBER'}, {'classCode': 'SPBFUT', 'ticker': 'CNYRUBF'}]
         :param int depth: Глубина стакана 1-20
         """
-        if self.ws_order_book is None:  # Если не подписаны
-            self.ws_order_book = connect(uri=f'{self.ws_server}/trade-api-market-data-connector/api/v1/market-data/ws', additional_headers=self._get_headers())  # Подключаемся к сервису WebSockets
-            Thread(target=self._subscribe_thread, args=('OrderBook', self.ws_order_book, self.on_order_book), name='OrderBookThread').start()  # Создаем и запускаем поток
         request = {'subscribeType': subscribe_type, 'dataType': 0, 'instruments': instruments, 'depth': depth}  # Формируем запрос
-        self.logger.debug(f'Подписка на стакан: {request}')
-        self.ws_order_book.send(dumps(request))  # Переводим JSON в строку, отправляем запрос
+        self.logger.debug('Подписка на стакан: %s', request)
+        self._send_market_data(request)  # Отправляем запрос
 
     def unsubscribe_order_book(self):
         """Отмена подписки на стаан"""
-        if self.ws_order_book is not None:  # Если подписаны
+        if self._md_subscriptions.get(0):  # Если подписаны
             self.logger.debug('Отмена подписки на стакан')
-            self.ws_order_book.close()  # то закрваем соединение
-            self.ws_order_book = None  # Сбрасываем подключение
+            self._unsubscribe_market_data(0)  # то отменяем все подписки этого типа данных
 
     # Обезличенные сделки https://trade-api.bcs.ru/market-data/trades
 
@@ -298,21 +445,43 @@ class BCSPy:
         """Подписка на обезличенные сделки
 
         :param int subscribe_type: 0 - подписка, 1 - отмена подписки
-        :param list[dict[str, str]] instruments: Список инструментов. instruments = [{'classCode': 'TQBR', 'ticker': 'SBER'}, {'classCode': 'SPBFUT', 'ticker': 'CNYRUBF'}]
+        :param list[dict[str, str]] instruments: Список инструментов. Все инструменты передаются одним запросом, поэтому несколько инструментов лучше подписывать одним вызовом. instruments = [{'classCode': 'TQBR', 'ticker': 'SBER'}, {'classCode': 'SPBFUT', 'ticker': 'CNYRUBF'}]
         """
-        if self.ws_trades is None:  # Если не подписаны
-            self.ws_trades = connect(uri=f'{self.ws_server}/trade-api-market-data-connector/api/v1/market-data/ws', additional_headers=self._get_headers())  # Подключаемся к сервису WebSockets
-            Thread(target=self._subscribe_thread, args=('Trades', self.ws_trades, self.on_trade), name='TradesThread').start()  # Создаем и запускаем поток
         request = {'subscribeType': subscribe_type, 'dataType': 2, 'instruments': instruments}  # Формируем запрос
-        self.logger.debug(f'Подписка на обезличенные сделки: {request}')
-        self.ws_trades.send(dumps(request))  # Переводим JSON в строку, отправляем запрос
+        self.logger.debug('Подписка на обезличенные сделки: %s', request)
+        self._send_market_data(request)  # Отправляем запрос
 
     def unsubscribe_trades(self):
         """Отмена подписки на обезличенные сделки"""
-        if self.ws_trades is not None:  # Если подписаны
+        if self._md_subscriptions.get(2):  # Если подписаны
             self.logger.debug('Отмена подписки на обезличенные сделки')
-            self.ws_trades.close()  # то закрваем соединение
-            self.ws_trades = None  # Сбрасываем подключение
+            self._unsubscribe_market_data(2)  # то отменяем все подписки этого типа данных
+
+    def _send_market_data(self, request: dict):
+        """Отправка запроса подписки/отмены подписки на рыночные данные
+
+        :param dict request: Запрос
+        """
+        if self.ws_market_data is None:  # Если не подключены
+            self.ws_market_data = self._connect(self._uri_market_data, 'MarketData', self._md_dispatch)  # Подключаемся к сервису WebSockets, запускаем задачу подписки
+        subscriptions = self._md_subscriptions.setdefault(request['dataType'], [])  # Запросы действующих подписок этого типа данных
+        subscription = {**request, 'subscribeType': 0}  # Запрос подписки
+        if request['subscribeType'] == 0 and subscription not in subscriptions:  # Если подписываемся
+            subscriptions.append(subscription)  # то запоминаем подписку
+        elif request['subscribeType'] == 1 and subscription in subscriptions:  # Если отменяем подписку
+            subscriptions.remove(subscription)  # то забываем подписку
+        self._run(self.ws_market_data.send(dumps(request), text=True))  # Переводим JSON в байты, отправляем запрос текстовым сообщением
+
+    def _unsubscribe_market_data(self, data_type: int):
+        """Отмена всех подписок на рыночные данные заданного типа. Если подписок больше нет, то соединение закрывается
+
+        :param int data_type: Тип данных: 0 - стакан, 1 - последние свечи, 2 - обезличенные сделки, 3 - котировки
+        """
+        for subscription in self._md_subscriptions.pop(data_type, []):  # Пробегаемся по всем подпискам этого типа данных
+            self._run(self.ws_market_data.send(dumps({**subscription, 'subscribeType': 1}), text=True))  # Отправляем запрос отмены подписки
+        if not any(self._md_subscriptions.values()) and self.ws_market_data is not None:  # Если подписок на рыночные данные больше нет
+            self._run(self.ws_market_data.close())  # то закрваем соединение
+            self.ws_market_data = None  # Сбрасываем подключение
 
     # Справочник https://trade-api.bcs.ru/information
 
@@ -322,7 +491,12 @@ class BCSPy:
         :param list[str] tickers: Список тикеров
         """
         params = {'tickers': tickers}
-        return self._check_result(post(url=f'{self.http_server}/trade-api-information-service/api/v1/instruments/by-tickers', json=params, headers=self._get_headers()))
+        return self._check_result(self._session.post(url=self._url_instruments_by_tickers, json=params, headers=self._get_headers()))
+
+    async def get_instrument_ticker_async(self, tickers: list[str]) -> list[dict]:
+        """Поиск инструмента по тикеру. Асинхронно. Параметры как у get_instrument_ticker"""
+        params = {'tickers': tickers}
+        return await self._request_async('POST', self._url_instruments_by_tickers, json=params)
 
     def get_instrument_type(self, ticker_type: str, base_asset_ticker: str):  # https://trade-api.bcs.ru/information/instrument-by-type
         """Поиск инструмента по типу инструмента
@@ -331,7 +505,12 @@ class BCSPy:
         :param str base_asset_ticker: Тикер базового актива. Обязательно, если ticker_type = OPTIONS
         """
         params = {'type': ticker_type, 'baseAssetTicker': base_asset_ticker}
-        return self._check_result(get(url=f'{self.http_server}/trade-api-information-service/api/v1/instruments/by-type', params=params, headers=self._get_headers()))
+        return self._check_result(self._session.get(url=self._url_instruments_by_type, params=params, headers=self._get_headers()))
+
+    async def get_instrument_type_async(self, ticker_type: str, base_asset_ticker: str):
+        """Поиск инструмента по типу инструмента. Асинхронно. Параметры как у get_instrument_type"""
+        params = {'type': ticker_type, 'baseAssetTicker': base_asset_ticker}
+        return await self._request_async('GET', self._url_instruments_by_type, params=params)
 
     def get_daily_schedule(self, class_code: str, ticker: str):  # https://trade-api.bcs.ru/information/schedule
         """Расписание инструмента
@@ -340,7 +519,12 @@ class BCSPy:
         :param str ticker: Тикер
         """
         params = {'classCode': class_code, 'ticker': ticker}
-        return self._check_result(get(url=f'{self.http_server}/trade-api-information-service/api/v1/trading-schedule/daily-schedule', params=params, headers=self._get_headers()))
+        return self._check_result(self._session.get(url=self._url_daily_schedule, params=params, headers=self._get_headers()))
+
+    async def get_daily_schedule_async(self, class_code: str, ticker: str):
+        """Расписание инструмента. Асинхронно. Параметры как у get_daily_schedule"""
+        params = {'classCode': class_code, 'ticker': ticker}
+        return await self._request_async('GET', self._url_daily_schedule, params=params)
 
     def get_trading_status(self, class_code: str):  # https://trade-api.bcs.ru/information/trading-status
         """Торговый статус инструмента
@@ -348,7 +532,12 @@ class BCSPy:
         :param str class_code: Режим торгов
         """
         params = {'classCode': class_code}
-        return self._check_result(get(url=f'{self.http_server}/trade-api-information-service/api/v1/trading-schedule/status', params=params, headers=self._get_headers()))
+        return self._check_result(self._session.get(url=self._url_trading_status, params=params, headers=self._get_headers()))
+
+    async def get_trading_status_async(self, class_code: str):
+        """Торговый статус инструмента. Асинхронно. Параметры как у get_trading_status"""
+        params = {'classCode': class_code}
+        return await self._request_async('GET', self._url_trading_status, params=params)
 
     # Маржинальные показатели https://trade-api.bcs.ru/marginal-indicators
 
@@ -356,25 +545,30 @@ class BCSPy:
         """Подписка на маржинальные показатели портфеля"""
         if self.ws_margins is None:  # Если не подписаны
             self.logger.debug('Подписка на маржинальные показатели портфеля')
-            self.ws_margins = connect(uri=f'{self.ws_server}/trade-api-bff-marginal-indicators/api/v1/marginal-indicators/ws', additional_headers=self._get_headers())  # Подключаемся к сервису WebSockets
-            Thread(target=self._subscribe_thread, args=('Margins', self.ws_margins, self.on_margin), name='MarginssThread').start()  # Создаем и запускаем поток
+            self.ws_margins = self._connect(self._uri_margins, 'Margins', self.on_margin)  # Подключаемся к сервису WebSockets, запускаем задачу подписки
 
     def unsubscribe_margins(self):
         """Отмена подписки на маржинальные показатели портфеля"""
         if self.ws_margins is not None:  # Если подписаны
             self.logger.debug('Отмена подписки на маржинальные показатели портфеля')
-            self.ws_margins.close()  # то закрваем соединение
+            self._run(self.ws_margins.close())  # то закрваем соединение
             self.ws_margins = None  # Сбрасываем подключение
 
     def get_instruments_discounts(self):  # https://trade-api.bcs.ru/marginal-indicators/discounts
         """Получение дисконтов"""
-        return self._check_result(get(url=f'{self.http_server}/trade-api-bff-marginal-indicators/api/v1/instruments-discounts', headers=self._get_headers()))
+        return self._check_result(self._session.get(url=self._url_instruments_discounts, headers=self._get_headers()))
+
+    async def get_instruments_discounts_async(self):
+        """Получение дисконтов. Асинхронно"""
+        return await self._request_async('GET', self._url_instruments_discounts)
 
     # Запросы REST
 
     def _get_headers(self):
         """Получение хедеров для запросов"""
-        return {'Authorization': f'Bearer {self.get_access_token()}'}
+        if self.access_token is None or time.monotonic() >= self.access_token_expired:  # Если токен доступа не был выдан или был просрочен
+            self._cached_headers = {'Authorization': f'Bearer {self.get_access_token()}'}  # то получаем хедеры с новым токеном доступа
+        return self._cached_headers
 
     def _check_result(self, response):
         """Анализ результата запроса
@@ -385,32 +579,154 @@ class BCSPy:
         if not response:  # Если ответ не пришел. Например, при таймауте
             self.logger.error('Ошибка запроса: Таймаут')  # Событие ошибки
             return None  # то возвращаем пустое значение
-        content = response.content.decode('utf-8')  # Результат запроса
+        content = response.content  # Результат запроса в виде байт. В текст переводим только при необходимости
         if response.status_code != 200:  # Если статус ошибки
-            self.logger.error(f'Ошибка запроса: {response.status_code} Запрос: {response.request.path_url} Ответ: {content}')  # Событие ошибки
+            self.logger.error(f'Ошибка запроса: {response.status_code} Запрос: {response.request.path_url} Ответ: {content.decode("utf-8", errors="replace")}')  # Событие ошибки
             return None  # то возвращаем пустое значение
-        self.logger.debug(f'Запрос : {response.request.path_url}')
-        self.logger.debug(f'Ответ  : {content}')
+        if self.logger.isEnabledFor(logging.DEBUG):  # Если ведем отладочный лог
+            self.logger.debug('Запрос : %s', response.request.path_url)
+            self.logger.debug('Ответ  : %s', content.decode('utf-8', errors='replace'))
         try:
-            return loads(content)  # Декодируем JSON в справочник, возвращаем его. Ошибки также могут приходить в виде JSON
+            return loads(content)  # Декодируем JSON из байт в справочник, возвращаем его. Ошибки также могут приходить в виде JSON
         except JSONDecodeError:  # Если произошла ошибка при декодировании JSON, например, при удалении заявок
-            return content  # то возвращаем значение в виде текста
+            return content.decode('utf-8', errors='replace')  # то возвращаем значение в виде текста
+
+    async def _request_async(self, method: str, url: str, params: dict = None, json: dict = None):
+        """Асинхронный запрос. Независимые запросы можно выполнять одновременно через asyncio.gather
+
+        :param str method: Метод запроса (GET, POST)
+        :param str url: Адрес запроса
+        :param dict params: Параметры запроса
+        :param dict json: Тело запроса
+        :return: Справочник из JSON, текст, None в случае веб ошибки
+        """
+        loop = asyncio.get_running_loop()  # Цикл событий вызывающего кода
+        if self._http is None or self._http.closed or self._http_loop is not loop:  # Если сессии нет или она создана в другом цикле событий
+            self._close_http()  # то закрываем предыдущую сессию без ожидания. Между проверкой и созданием сессии управление не передаем, чтобы одновременные запросы не создали несколько сессий
+            self._http = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=32, ttl_dns_cache=300))  # то создаем сессию. Соединения используются повторно
+            self._http_loop = loop  # Запоминаем цикл событий сессии
+            self._token_lock = asyncio.Lock()  # Блокировка получения токена доступа в этом цикле событий
+        if self.access_token is None or time.monotonic() >= self.access_token_expired:  # Если токен доступа не был выдан или был просрочен
+            async with self._token_lock:  # Новый токен доступа получает только один из одновременных запросов. Остальные ждут
+                if self.access_token is None or time.monotonic() >= self.access_token_expired:  # Если токен доступа не получен другим запросом, пока ждали
+                    await asyncio.to_thread(self._get_headers)  # то получаем новый токен доступа в отдельном потоке, чтобы не останавливать цикл событий
+        headers = self._cached_headers  # Хедеры с действующим токеном доступа
+        if params is not None:  # Если есть параметры запроса
+            params = {key: value for key, value in params.items() if value is not None}  # то убираем пустые параметры, как это делает requests
+        async with self._http.request(method, url, params=params, json=json, headers=headers) as response:  # Выполняем запрос
+            return await self._check_result_async(response)
+
+    async def _check_result_async(self, response):
+        """Анализ результата асинхронного запроса
+
+        :param aiohttp.ClientResponse response: Результат запроса
+        :return: Справочник из JSON, текст, None в случае веб ошибки
+        """
+        content = await response.read()  # Результат запроса в виде байт. В текст переводим только при необходимости
+        if response.status != 200:  # Если статус ошибки
+            self.logger.error(f'Ошибка запроса: {response.status} Запрос: {response.url.path_qs} Ответ: {content.decode("utf-8", errors="replace")}')  # Событие ошибки
+            return None  # то возвращаем пустое значение
+        if self.logger.isEnabledFor(logging.DEBUG):  # Если ведем отладочный лог
+            self.logger.debug('Запрос : %s', response.url.path_qs)
+            self.logger.debug('Ответ  : %s', content.decode('utf-8', errors='replace'))
+        try:
+            return loads(content)  # Декодируем JSON из байт в справочник, возвращаем его. Ошибки также могут приходить в виде JSON
+        except JSONDecodeError:  # Если произошла ошибка при декодировании JSON, например, при удалении заявок
+            return content.decode('utf-8', errors='replace')  # то возвращаем значение в виде текста
 
     # Подписки WebSocket
 
-    def _subscribe_thread(self, name: str, ws: ClientConnection, event):
-        """Поток подписки"""
-        while True:  # Пока получаем данные
-            try:
-                response_json = ws.recv()  # Ожидаем ответ
+    def _start_loop(self):
+        """Запуск цикла событий подписок и потока обработчиков событий, если они еще не запущены"""
+        if self._loop is not None:  # Если цикл событий уже запущен
+            return  # то выходим, дальше не продолжаем
+        self._loop = asyncio.new_event_loop() if uvloop is None else uvloop.new_event_loop()  # Цикл событий, в котором работают все подписки
+        self._loop_thread = Thread(target=self._loop.run_forever, name='WebSocketThread', daemon=True)  # Поток цикла событий
+        self._loop_thread.start()  # Запускаем поток цикла событий
+        self._callback_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='EventThread', initializer=self._set_callback_thread)  # Обработчики событий вызываем по порядку в одном потоке, чтобы медленный обработчик не останавливал цикл событий
+
+    def _set_callback_thread(self):
+        """Запоминаем поток обработчиков событий. Выполняется в нем при запуске"""
+        self._callback_thread = current_thread()  # Поток обработчиков событий
+
+    def _stop_loop(self):
+        """Остановка цикла событий подписок и потока обработчиков событий"""
+        if self._loop is None:  # Если цикл событий не запускался
+            return  # то останавливать нечего
+        loop, loop_thread, callback_executor = self._loop, self._loop_thread, self._callback_executor  # Цикл событий, его поток и исполнитель обработчиков событий
+        in_callback = current_thread() is self._callback_thread  # Остановку вызвали из обработчика события
+        self._loop = self._loop_thread = self._callback_executor = self._callback_thread = None  # Сбрасываем сразу, даже если остановка завершится с ошибкой. Следующая подписка запустит их заново
+        try:
+            asyncio.run_coroutine_threadsafe(self._cancel_tasks_async(), loop).result()  # Отменяем оставшиеся задачи подписок
+        finally:
+            callback_executor.shutdown(wait=not in_callback, cancel_futures=in_callback)  # Дожидаемся выполнения оставшихся обработчиков событий. Из обработчика свой поток не ждем, оставшиеся события отменяем
+            loop.call_soon_threadsafe(loop.stop)  # Останавливаем цикл событий
+            loop_thread.join()  # Ждем завершения потока цикла событий
+            loop.close()  # Закрываем цикл событий
+
+    async def _cancel_tasks_async(self):
+        """Отмена задач подписок с ожиданием их завершения"""
+        for task in self._tasks:  # Пробегаемся по всем задачам подписок
+            task.cancel()  # Отменяем задачу
+        await asyncio.gather(*self._tasks, return_exceptions=True)  # Ждем завершения всех задач
+
+    def _run(self, coro):
+        """Выполнение корутины в цикле событий подписок с ожиданием результата
+
+        :param coro: Корутина
+        :return: Результат выполнения корутины
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def _connect(self, uri: str, name: str, event) -> ClientConnection:
+        """Подключение к сервису WebSockets и запуск задачи подписки
+
+        :param str uri: Адрес сервиса WebSockets
+        :param str name: Название подписки
+        :param Event | dict[int, Event] event: Событие или справочник событий по типу данных, которое вызывается при получении данных подписки
+        :return: Соединение WebSockets
+        """
+        self._start_loop()  # Цикл событий подписок запускаем только при первой подписке
+        return self._run(self._connect_async(uri, self._get_headers(), name, event))  # Хедеры получаем в вызывающем потоке, т.к. при получении токена доступа выполняется синхронный запрос
+
+    async def _connect_async(self, uri: str, headers: dict, name: str, event) -> ClientConnection:
+        """Подключение к сервису WebSockets и запуск задачи подписки в цикле событий"""
+        ws = await connect(uri=uri, additional_headers=headers, max_size=None, close_timeout=1.0)  # Подключаемся к сервису WebSockets. Размер сообщений не ограничиваем. Закрытие соединения ждем не более 1 секунды
+        task = asyncio.create_task(self._subscribe_task(name, ws, event), name=f'{name}Task')  # Создаем и запускаем задачу подписки
+        self._tasks.add(task)  # Запоминаем задачу
+        task.add_done_callback(self._tasks.discard)  # После завершения задачи удаляем ее
+        return ws
+
+    async def _subscribe_task(self, name: str, ws: ClientConnection, event):
+        """Задача подписки
+
+        :param str name: Название подписки
+        :param ClientConnection ws: Соединение WebSockets
+        :param Event | dict[int, Event] event: Событие или справочник событий по типу данных для рыночных данных
+        """
+        events = event if isinstance(event, dict) else None  # Справочник событий по типу данных
+
+        def log_callback_error(future: asyncio.Future) -> None:  # Ошибки обработчиков событий записываем в лог
+            if not future.cancelled() and future.exception() is not None:  # Если обработчик события завершился с ошибкой
+                self.logger.error(f'{name}: Ошибка обработчика подписки {future.exception()}')
+
+        try:
+            while True:  # Пока получаем данные
+                response_json = await ws.recv(decode=False)  # Ожидаем ответ в виде байт. Отдельная проверка UTF-8 не нужна, ее выполняет orjson при разборе JSON
                 response = loads(response_json)  # Переводим JSON в словарь
-                self.logger.debug(f'Данные подписки : {response}')
-                event.trigger(response)  # Вызываем событие
-            except ConnectionClosed:  # Событие закрытия соединения
-                return  # Выходим, дальше не продолжаем
-            except Exception as ex:  # При других типах ошибок
-                self.logger.error(f'{name}: Ошибка получения подписки {ex}')
-                return  # Выходим, дальше не продолжаем
+                if self.logger.isEnabledFor(logging.DEBUG):  # Если ведем отладочный лог
+                    self.logger.debug('Данные подписки : %s', response)  # Данные переводим в строку только при записи в лог
+                if events is not None:  # Если событие выбираем по типу данных
+                    event = events.get(response.get('dataType')) if isinstance(response, dict) else None  # то получаем событие по типу данных
+                    if event is None:  # Если событие не найдено
+                        self.logger.warning(f'{name}: Неизвестный тип данных подписки {response}')
+                        continue  # то переходим к следующему ответу
+                self._loop.run_in_executor(self._callback_executor, event.trigger, response).add_done_callback(log_callback_error)  # Вызываем событие в потоке обработчиков
+        except ConnectionClosed:  # Событие закрытия соединения
+            return  # Выходим, дальше не продолжаем
+        except Exception as ex:  # При других типах ошибок
+            self.logger.error(f'{name}: Ошибка получения подписки {ex}')
+            return  # Выходим, дальше не продолжаем
 
     # Выход и закрытие
 
@@ -418,20 +734,48 @@ class BCSPy:
         """Выход из класса, например, с with"""
         self.close_web_socket()  # Закрываем соединение с сервером WebSocket
 
-    def __del__(self):
-        self.close_web_socket()  # Закрываем соединение с сервером WebSocket
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        """Выход из класса, например, с async with"""
+        await self.close_async()  # Закрываем сессию асинхронных запросов в цикле событий вызывающего кода
+        await asyncio.to_thread(self.close_web_socket)  # Закрываем соединение с сервером WebSocket, не останавливая цикл событий
+
+    async def close_async(self):
+        """Закрытие сессии асинхронных запросов. Вызывается из того же цикла событий, что и асинхронные запросы. Например, через async with"""
+        if self._http_loop is not asyncio.get_running_loop():  # Если сессии нет или она создана в другом цикле событий
+            self._close_http()  # то закрываем ее без ожидания
+            return  # Выходим, дальше не продолжаем
+        http = self._http  # Сессия
+        self._http = self._http_loop = None  # Сбрасываем сессию и ее цикл событий до ожидания закрытия
+        await http.close()  # Закрываем сессию
 
     def close_web_socket(self):
         """Закрытие соединения с сервером WebSocket"""
-        self.unsubscribe_limits()  # Лимиты
-        self.unsubscribe_portfolio()  # Портфель
-        self.unsubscribe_executions()  # Исполненные заявки
-        self.unsubscribe_transactions()  # Статус созданных заявок
-        self.unsubscribe_quotes()  # Котировки
-        self.unsubscribe_last_candles()  # Последние свечи
-        self.unsubscribe_order_book()  # Стакан
-        self.unsubscribe_trades()  # Обезличенные сделки
-        self.unsubscribe_margins()  # Маржинальные показатели
+        connections = [ws for ws in (self.ws_limits, self.ws_portfolio, self.ws_executions, self.ws_transactions, self.ws_market_data, self.ws_margins) if ws is not None]  # Открытые соединения
+        self.ws_limits = self.ws_portfolio = self.ws_executions = self.ws_transactions = self.ws_market_data = self.ws_margins = None  # Сбрасываем подключения
+        self._md_subscriptions.clear()  # Подписки на рыночные данные закрываются вместе с соединением
+        if connections:  # Если есть открытые соединения
+            self.logger.debug(f'Закрытие соединений WebSocket: {len(connections)}')
+            self._run(self._close_connections_async(connections))  # то закрываем их все одновременно
+        self._stop_loop()  # Останавливаем цикл событий подписок и поток обработчиков событий
+        self._close_http()  # Закрываем сессию асинхронных запросов
+
+    def _close_http(self):
+        """Закрытие сессии асинхронных запросов без ожидания. Можно вызывать из любого потока и цикла событий"""
+        http, loop = self._http, self._http_loop  # Сессия и ее цикл событий
+        self._http = self._http_loop = None  # Сбрасываем сессию и ее цикл событий
+        if http is None or http.closed:  # Если сессии нет или она уже закрыта
+            return  # то закрывать нечего
+        if loop.is_running():  # Если цикл событий сессии работает. Например, при выходе из with внутри корутины
+            asyncio.run_coroutine_threadsafe(http.close(), loop)  # то закрываем сессию в ее цикле событий
+        # Если цикл событий сессии завершен, например, после asyncio.run, то закрыть соединения сессии уже нельзя. Сессию только забываем
+
+    @staticmethod
+    async def _close_connections_async(connections: list[ClientConnection]):
+        """Одновременное закрытие соединений WebSockets
+
+        :param list[ClientConnection] connections: Соединения WebSockets
+        """
+        await asyncio.gather(*(ws.close() for ws in connections))  # Ждем, пока закроются все соединения
 
     # Функции конвертации
 
@@ -441,16 +785,25 @@ class BCSPy:
         :param str dataname: Название тикера
         :return: Код режима торгов и тикер
         """
-        symbol_parts = dataname.split('.')  # По разделителю пытаемся разбить тикер на части
-        if len(symbol_parts) >= 2:  # Если тикер задан в формате <Код режима торгов>.<Код тикера>
-            class_code = symbol_parts[0]  # Код режима торгов
-            ticker = '.'.join(symbol_parts[1:])  # Код тикера
-        else:  # Если тикер задан без кода режима торгов
+        return self._dataname_cache(dataname)  # Из кэша или разбором названия тикера
+
+    def _get_class_code_ticker(self, dataname: str) -> tuple[str | None, str]:
+        """Код режима торгов и тикер из названия тикера без кэша
+
+        :param str dataname: Название тикера
+        :return: Код режима торгов и тикер
+        """
+        class_code, separator, ticker = dataname.partition('.')  # По первому разделителю пытаемся разбить тикер на код режима торгов и код тикера
+        if not separator:  # Если тикер задан без кода режима торгов
             ticker = dataname  # Код тикера
             si = self.get_instrument_ticker([ticker])  # Информация о тикере
             class_code = None if len(si) == 0 else si[0]['boards'][0]['classCode']  # Код режима торгов
         return class_code, ticker
 
+    def clear_instrument_cache(self) -> None:
+        """Очистка кэша кодов режимов торгов и тикеров. Например, при смене торгового дня"""
+        self._dataname_cache.cache_clear()
+
     @staticmethod
     def class_code_ticker_to_dataname(class_code, ticker) -> str:
         """Название тикера из кода режима торгов и тикера
@@ -469,6 +822,9 @@ class BCSPy:
         :return: Время UTC
         :rtype: datetime
         """
+        if dt.tzinfo is None and dt >= self._msk_fixed_since:  # Если смещение московского времени постоянное
+            dt_utc = dt - self._msk_offset  # то переводим в UTC без поиска смещения во временнОй зоне
+            return dt_utc.replace(tzinfo=timezone.utc) if tzinfo else dt_utc
         dt_msk = dt.replace(tzinfo=self.tz_msk)  # Заданное время ставим в зону МСК
         dt_utc = dt_msk.astimezone(timezone.utc)  # Переводим в зону UTC
         return dt_utc if tzinfo else dt_utc.replace(tzinfo=None)
@@ -481,21 +837,77 @@ class BCSPy:
         :return: Московское время
         :rtype: datetime
         """
+        if dt.tzinfo is None and dt >= self._utc_fixed_since:  # Если смещение московского времени постоянное
+            dt_msk = dt + self._msk_offset  # то переводим в МСК без поиска смещения во временнОй зоне
+            return dt_msk.replace(tzinfo=self.tz_msk) if tzinfo else dt_msk
         dt_utc = dt.replace(tzinfo=timezone.utc)  # Заданное время ставим в зону UTC
         dt_msk = dt_utc.astimezone(self.tz_msk)  # Переводим в зону МСК
         return dt_msk if tzinfo else dt_msk.replace(tzinfo=None)
 
+    def msk_to_utc_bulk(self, dts) -> np.ndarray:
+        """Перевод массива времени из московского в UTC
+
+        :param dts: Московское время. Массив numpy.datetime64 или список datetime без временнОй зоны
+        :return: Время UTC
+        :rtype: np.ndarray
+        """
+        dts = np.asarray(dts, dtype='datetime64[us]')  # Массив даты и времени с точностью до микросекунд
+        dts_utc = dts - np.timedelta64(self._msk_offset)  # Переводим в UTC постоянным смещением все значения сразу
+        before_fixed = dts < np.datetime64(self._msk_fixed_since)  # Значения до перехода на постоянное смещение
+        if before_fixed.any():  # Если такие значения есть
+            dts_utc[before_fixed] = [self.msk_to_utc_datetime(dt) for dt in dts[before_fixed].astype(datetime)]  # то переводим их по временнОй зоне
+        return dts_utc
+
+    def utc_to_msk_bulk(self, dts) -> np.ndarray:
+        """Перевод массива времени из UTC в московское
+
+        :param dts: Время UTC. Массив numpy.datetime64 или список datetime без временнОй зоны
+        :return: Московское время
+        :rtype: np.ndarray
+        """
+        dts = np.asarray(dts, dtype='datetime64[us]')  # Массив даты и времени с точностью до микросекунд
+        dts_msk = dts + np.timedelta64(self._msk_offset)  # Переводим в МСК постоянным смещением все значения сразу
+        before_fixed = dts < np.datetime64(self._utc_fixed_since)  # Значения до перехода на постоянное смещение
+        if before_fixed.any():  # Если такие значения есть
+            dts_msk[before_fixed] = [self.utc_to_msk_datetime(dt) for dt in dts[before_fixed].astype(datetime)]  # то переводим их по временнОй зоне
+        return dts_msk
+
+    @staticmethod
+    def _keyring_map(func, items) -> list:
+        """Выполнение операции с системным хранилищем keyring для каждого элемента.
+        Если хранилище допускает одновременные запросы, то операции выполняются параллельно.
+        Отключить параллельное выполнение можно переменной окружения BCSPY_KEYRING_PARALLEL=0
+
+        :param func: Операция с хранилищем для одного элемента
+        :param items: Элементы
+        :return: Результаты операций в порядке элементов
+        """
+        parallel = os.environ.get('BCSPY_KEYRING_PARALLEL', '1') != '0' and not type(keyring.get_keyring()).__module__.startswith('keyring.backends.macOS')  # Связка ключей macOS все равно выполняет запросы по очереди
+        if not parallel:  # Если параллельное выполнение недоступно
+            return [func(item) for item in items]  # то выполняем операции по очереди
+        with ThreadPoolExecutor(max_workers=8) as executor:  # Каждый запрос к хранилищу ждет ответа от системы. Ожидания выполняем одновременно
+            return list(executor.map(func, items))  # Ошибка любой операции передается вызывающему коду
+
     def get_long_token_from_keyring(self, service: str, username: str) -> str | None:
         """Получение токена из системного хранилища keyring по частям"""
         try:
-            index = 0  # Номер части токена
-            token_parts = []  # Части токена
-            while True:  # Пока есть части токена
-                token_part = keyring.get_password(service, f'{username}{index}')  # Получаем часть токена
-                if token_part is None:  # Если части токена нет
-                    break  # то выходим, дальше не продолжаем
-                token_parts.append(token_part)  # Добавляем часть токена
-                index += 1  # Переходим к следующей части токена
+            token_parts_count = keyring.get_password(service, f'{username}_count')  # Кол-во частей токена
+            if token_parts_count is not None:  # Если кол-во частей токена сохранено
+                token_parts = self._keyring_map(lambda index: keyring.get_password(service, f'{username}{index}'), range(int(token_parts_count)))  # то получаем все части токена сразу. Части токена в порядке номеров
+                if None in token_parts:  # Если какой-то части токена нет
+                    self.logger.error(f'Токен в системном хранилище поврежден. Вызовите bp_provider = BCSPy("<Токен>")')
+                    return None
+            else:  # Если кол-во частей токена не сохранено (токен сохранен предыдущей версией библиотеки)
+                index = 0  # Номер части токена
+                token_parts = []  # Части токена
+                while True:  # Пока есть части токена
+                    token_part = keyring.get_password(service, f'{username}{index}')  # Получаем часть токена
+                    if token_part is None:  # Если части токена нет
+                        break  # то выходим, дальше не продолжаем
+                    token_parts.append(token_part)  # Добавляем часть токена
+                    index += 1  # Переходим к следующей части токена
+                if token_parts:  # Если токен найден
+                    keyring.set_password(service, f'{username}_count', str(len(token_parts)))  # то сохраняем кол-во частей токена для следующих загрузок
             if not token_parts:  # Если токен не найден
                 self.logger.error(f'Токен не найден в системном хранилище. Вызовите bp_provider = BCSPy("<Токен>")')
                 return None
@@ -508,13 +920,26 @@ class BCSPy:
             self.logger.fatal(f'Ошибка при загрузке токена: {e}')
 
     def set_long_token_to_keyring(self, service: str, username: str, token: str, password_split_size: int = 500) -> None:
-        """Установка токена в системное хранилище keyring по частям"""
+        """Установка токена в системное хранилище keyring по частям
+
+        :param str service: Сервис в хранилище
+        :param str username: Имя пользователя в хранилище. К нему добавляется номер части токена
+        :param str token: Токен
+        :param int password_split_size: Размер части токена в байтах
+        """
         try:
+            token_stream = io.BytesIO(token.encode('ascii'))  # Токен состоит из символов ASCII. Размер частей ограничиваем в байтах, как и хранилища. Проверяем токен до удаления сохраненного
             self.clear_long_token_from_keyring(service, username)  # Очищаем предыдущие части токена
-            token_parts = [token[i:i + password_split_size] for i in range(0, len(token), password_split_size)]  # Разбиваем токен на части заданного размера
-            for index, token_part in enumerate(token_parts):  # Пробегаемся по частям токена
-                keyring.set_password(service, f'{username}{index}', token_part)  # Сохраняем часть токена
-            self.logger.debug(f'Частей сохраненного токена в хранилище: {len(token_parts)}')
+            buffer = bytearray(password_split_size)  # Один буфер для чтения всех частей токена
+            buffer_view = memoryview(buffer)  # Срезы буфера без копирования
+
+            def read_token_parts():  # Части токена по мере чтения
+                while size := token_stream.readinto(buffer):  # Пока читаются байты токена
+                    yield str(buffer_view[:size], 'ascii')  # Строку части создаем прямо из буфера
+
+            token_parts_count = len(self._keyring_map(lambda indexed_part: keyring.set_password(service, f'{username}{indexed_part[0]}', indexed_part[1]), enumerate(read_token_parts())))  # Сохраняем все части токена сразу
+            keyring.set_password(service, f'{username}_count', str(token_parts_count))  # Сохраняем кол-во частей токена
+            self.logger.debug(f'Частей сохраненного токена в хранилище: {token_parts_count}')
         except keyring.errors.KeyringError as e:
             self.logger.fatal(f'Ошибка сохранения в системное хранилище: {e}')
         except Exception as e:
@@ -523,30 +948,56 @@ class BCSPy:
     def clear_long_token_from_keyring(self, service: str, username: str) -> None:
         """Удаление всех частей токена из системного хранилища keyring"""
         try:
-            index = 0  # Номер части токена
-            while True:  # Пока есть части токена
-                if keyring.get_password(service, f'{username}{index}') is None:  # Если части токена нет
-                    break  # то выходим, дальше не продолжаем
-                keyring.delete_password(service, f'{username}{index}')  # Удаляем часть токена
-                index += 1  # Переходим к следующей части токена
+            token_parts_count = keyring.get_password(service, f'{username}_count')  # Кол-во частей токена
+            if token_parts_count is not None:  # Если кол-во частей токена сохранено
+                def delete_token_part(index: int) -> None:  # Удаление части токена
+                    try:
+                        keyring.delete_password(service, f'{username}{index}')  # Удаляем часть токена
+                    except keyring.errors.PasswordDeleteError:  # Если части токена нет
+                        pass  # то удалять нечего
+
+                self._keyring_map(delete_token_part, range(int(token_parts_count)))  # то удаляем все сохраненные части токена сразу
+                keyring.delete_password(service, f'{username}_count')  # Удаляем кол-во частей токена
+            else:  # Если кол-во частей токена не сохранено (токен сохранен предыдущей версией библиотеки)
+                for index in itertools.count():  # Пробегаемся по номерам частей токена
+                    try:
+                        keyring.delete_password(service, f'{username}{index}')  # Сразу удаляем часть токена без предварительной проверки
+                    except keyring.errors.PasswordDeleteError:  # Если части токена нет
+                        break  # то выходим, дальше не продолжаем
         except keyring.errors.KeyringError as e:
             self.logger.fatal(f'Ошибка доступа к системному хранилищу: {e}')
 
 
+class Candles(NamedTuple):
+    """Свечи в виде массивов NumPy по каждому полю"""
+    time: np.ndarray  # Время UTC (datetime64[s])
+    open: np.ndarray  # Цены открытия
+    high: np.ndarray  # Максимальные цены
+    low: np.ndarray  # Минимальные цены
+    close: np.ndarray  # Цены закрытия
+    volume: np.ndarray  # Объемы
+
+
 class Event:
     """Событие с подпиской / отменой подписки"""
     def __init__(self):
-        self._callbacks: set[Any] = set()  # Избегаем дубликатов функций при помощи set
+        self._subscribed: dict[Any, None] = {}  # Функции в порядке подписки. Ключи словаря избегают дубликатов и сохраняют порядок добавления
+        self._callbacks: tuple[Any, ...] = ()  # Функции для вызова. При подписке/отмене подписки кортеж заменяется целиком
 
     def subscribe(self, callback) -> None:
         """Подписаться на событие"""
-        self._callbacks.add(callback)  # Добавляем функцию в список
+        if callback not in self._subscribed:  # Если функции нет в списке
+            self._subscribed[callback] = None  # то добавляем функцию в конец списка
+            self._callbacks = tuple(self._subscribed)  # Новый кортеж функций для вызова в порядке подписки
 
     def unsubscribe(self, callback) -> None:
         """Отписаться от события"""
-        self._callbacks.discard(callback)  # Удаляем функцию из списка. Если функции нет в списке, то не будет ошибки
+        if callback in self._subscribed:  # Если функция есть в списке. Если функции нет в списке, то не будет ошибки
+            del self._subscribed[callback]  # то удаляем функцию из списка
+            self._callbacks = tuple(self._subscribed)  # Новый кортеж функций для вызова в порядке подписки
 
     def trigger(self, *args, **kwargs) -> None:
-        """Вызвать событие"""
-        for callback in list(self._callbacks):  # Пробегаемся по копии списка, чтобы избежать исключения при удалении
+        """Вызвать событие. Функции вызываются в порядке подписки.
+        Функции, подписанные/отписанные во время вызова, учитываются со следующего вызова события"""
+        for callback in self._callbacks:  # Пробегаемся по кортежу без копирования. Подписка/отмена подписки во время вызова создает новый кортеж и не мешает перебору
             callback(*args, **kwargs)  # Вызываем функцию
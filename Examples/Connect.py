@@ -1,19 +1,28 @@
 import logging  # Выводим лог на консоль и в файл
+from logging.handlers import QueueHandler, QueueListener  # Запись лога через очередь в отдельном потоке
+from queue import SimpleQueue  # Очередь записей лога
+import atexit  # Остановка записи лога при выходе
+import time  # Время для лога
 from datetime import datetime  # Дата и время
 
 from BCSPy.BCSPy import BCSPy
 
 
+def get_msk_datetime(date_time: str) -> datetime:  # Московское время из строки даты/времени UTC
+    return bp_provider.utc_to_msk_datetime(datetime.fromisoformat(date_time[:-1]))  # Убираем признак UTC (Z) в конце строки
+
+
 def on_new_bar(response):  # Обработчик события прихода нового бара
-    global last_bar, dt_last_bar  # Последний полученный бар и его дата/время
-    dt_bar_close = bp_provider.utc_to_msk_datetime(datetime.fromisoformat(response['dateTime'][:-1]))  # БКС передает дату/время закрытия бара
-    if dt_last_bar is not None and dt_last_bar < dt_bar_close:  # Если время бара стало больше (предыдущий бар закрыт, новый бар открыт)
-        logger.info(f'{dt_bar_close:%d.%m.%Y %H:%M} '
-                    f'O:{last_bar["open"]} '
-                    f'H:{last_bar["high"]} '
-                    f'L:{last_bar["low"]} '
-                    f'C:{last_bar["close"]} '
-                    f'V:{int(last_bar["volume"])}')
+    global last_bar, dt_last_bar, last_date_time  # Последний полученный бар, его дата/время и строка даты/времени
+    date_time = response['dateTime']  # Строка даты/времени закрытия бара
+    if date_time == last_date_time:  # Если пришло обновление того же бара
+        last_bar = response  # то запоминаем бар
+        return  # Дата/время бара не изменились. Разбирать и сравнивать их не нужно
+    last_date_time = date_time  # Запоминаем строку даты/времени бара
+    dt_bar_close = get_msk_datetime(date_time)  # БКС передает дату/время закрытия бара
+    if dt_last_bar is not None and dt_last_bar < dt_bar_close and logger.isEnabledFor(logging.INFO):  # Если время бара стало больше (предыдущий бар закрыт, новый бар открыт), и сообщение попадет в лог
+        logger.info('%s O:%s H:%s L:%s C:%s V:%d',  # Строку сообщения соберет обработчик лога
+                    dt_bar_close.strftime('%d.%m.%Y %H:%M'), last_bar['open'], last_bar['high'], last_bar['low'], last_bar['close'], int(last_bar['volume']))
     last_bar = response  # Запоминаем бар
     dt_last_bar = dt_bar_close  # Запоминаем дату и время бара
 
@@ -23,11 +32,20 @@ if __name__ == '__main__':  # Точка входа при запуске это
     # bp_provider = BCSPy('<Токен>')  # При первом подключении нужно передать токен
     bp_provider = BCSPy()  # Подключаемся ко всем торговым счетам
 
-    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',  # Формат сообщения
-                        datefmt='%d.%m.%Y %H:%M:%S',  # Формат даты
+    formatter = logging.Formatter(fmt='%(asctime)s - %(name)s - %(levelname)s - %(message)s',  # Формат сообщения
+                                  datefmt='%d.%m.%Y %H:%M:%S')  # Формат даты
+    handlers = [logging.FileHandler('Connect.log', encoding='utf-8'), logging.StreamHandler()]  # Лог записываем в файл и выводим на консоль
+    for handler in handlers:  # Пробегаемся по всем обработчикам лога
+        handler.setFormatter(formatter)  # Устанавливаем формат
+    log_queue = SimpleQueue()  # Очередь записей лога
+    log_listener = QueueListener(log_queue, *handlers, respect_handler_level=True)  # Запись в файл и вывод на консоль выполняем в отдельном потоке
+    log_listener.start()  # Запускаем поток записи лога
+    atexit.register(log_listener.stop)  # При выходе записываем оставшиеся в очереди записи лога
+    logging.basicConfig(format='%(message)s',  # В очередь ставим текст сообщения. Дату, источник и уровень добавит формат обработчиков
                         level=logging.INFO,  # Уровень логируемых событий NOTSET/DEBUG/INFO/WARNING/ERROR/CRITICAL
-                        handlers=[logging.FileHandler('Connect.log', encoding='utf-8'), logging.StreamHandler()])  # Лог записываем в файл и выводим на консоль
-    logging.Formatter.converter = lambda *args: datetime.now(tz=bp_provider.tz_msk).timetuple()  # В логе время указываем по МСК
+                        handlers=[QueueHandler(log_queue)])  # Записи лога только ставим в очередь, не дожидаясь записи в файл и вывода на консоль
+    msk_offset = int(bp_provider.tz_msk.utcoffset(datetime.now()).total_seconds())  # Смещение МСК от UTC в секундах. Постоянное, поэтому вычисляем один раз
+    logging.Formatter.converter = lambda formatter_self, secs: time.gmtime(secs + msk_offset)  # В логе время записи указываем по МСК
     logging.getLogger('urllib3').setLevel(logging.CRITICAL + 1)  # Не пропускать в лог
     logging.getLogger('websockets').setLevel(logging.CRITICAL + 1)  # события в этих библиотеках
 
@@ -43,7 +61,9 @@ if __name__ == '__main__':  # Точка входа при запуске это
     bp_provider.on_candle.subscribe(on_new_bar)  # Обработчик события прихода нового бара
     last_bar: dict  # Последнего полученного бара пока нет
     dt_last_bar = None  # И даты/времени у него пока нет
-    bp_provider.subscribe_last_candles(0, [{'classCode': class_code, 'ticker': ticker}], tf)  # Подписываемся на новые бары
+    last_date_time = None  # И строки даты/времени тоже
+    instruments = [{'classCode': class_code, 'ticker': ticker}]  # Инструменты подписки. Для нескольких тикеров добавляем их в этот список, а не вызываем подписку для каждого
+    bp_provider.subscribe_last_candles(0, instruments, tf)  # Подписываемся на новые бары всех инструментов одним запросом
 
     # Выход
     input('Enter - выход\n')
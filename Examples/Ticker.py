@@ -1,37 +1,70 @@
 import logging  # Выводим лог на консоль и в файл
+from logging.handlers import QueueHandler, QueueListener  # Запись лога через очередь в отдельном потоке
+from queue import SimpleQueue  # Очередь записей лога
+import atexit  # Остановка записи лога при выходе
+import time  # Время для лога
 from datetime import date, timedelta, datetime  # Дата и время
 
 from BCSPy.BCSPy import BCSPy
 
 
-def get_future_on_date(base, future_date=date.today()):  # Фьючерсный контракт на дату
+future_periods = ('', 'H', 'H', 'H', 'M', 'M', 'M', 'U', 'U', 'U', 'Z', 'Z', 'Z')  # Месяц экспирации по номеру месяца: 3-H, 6-M, 9-U, 12-Z
+
+
+def get_future_on_date(base, future_date=None):  # Фьючерсный контракт на дату
+    if future_date is None:  # Если дата не указана
+        future_date = date.today()  # то берем текущую дату на момент вызова
     if future_date.day > 15 and future_date.month in (3, 6, 9, 12):  # Если нужно переходить на следующий фьючерс
         future_date += timedelta(days=30)  # то добавляем месяц к дате
-    period = 'H' if future_date.month <= 3 else 'M' if future_date.month <= 6 else 'U' if future_date.month <= 9 else 'Z'  # Месяц экспирации: 3-H, 6-M, 9-U, 12-Z
+    period = future_periods[future_date.month]  # Месяц экспирации
     digit = future_date.year % 10  # Последняя цифра года
     return f'SPBFUT.{base}{period}{digit}'
 
 
+def get_class_code_ticker(dataname):  # Код режима торгов и тикер из названия тикера
+    dot = dataname.find('.')  # Позиция разделителя кода режима торгов и тикера
+    if dot < 0:  # Если тикер задан без кода режима торгов
+        return bp_provider.dataname_to_class_code_ticker(dataname)  # то код режима торгов получаем из справочника
+    return dataname[:dot], dataname[dot + 1:]  # Код режима торгов и тикер срезами строки без вызова библиотеки
+
+
+def get_lot_size(lot_size):  # Лот из строки вида "10" или "10.0" без промежуточного перевода в float
+    text = str(lot_size)  # Лот может прийти и строкой, и числом
+    dot = text.find('.')  # Позиция дробной части
+    return int(text) if dot < 0 else int(text[:dot])  # Целая часть лота
+
+
 if __name__ == '__main__':  # Точка входа при запуске этого скрипта
     logger = logging.getLogger('BCSPy.Ticker')  # Будем вести лог
     bp_provider = BCSPy()  # Подключаемся ко всем торговым счетам
 
-    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',  # Формат сообщения
-                        datefmt='%d.%m.%Y %H:%M:%S',  # Формат даты
+    formatter = logging.Formatter(fmt='%(asctime)s - %(name)s - %(levelname)s - %(message)s',  # Формат сообщения
+                                  datefmt='%d.%m.%Y %H:%M:%S')  # Формат даты
+    handlers = [logging.FileHandler('Ticker.log', encoding='utf-8'), logging.StreamHandler()]  # Лог записываем в файл и выводим на консоль
+    for handler in handlers:  # Пробегаемся по всем обработчикам лога
+        handler.setFormatter(formatter)  # Устанавливаем формат
+    log_queue = SimpleQueue()  # Очередь записей лога
+    log_listener = QueueListener(log_queue, *handlers, respect_handler_level=True)  # Запись в файл и вывод на консоль выполняем в отдельном потоке
+    log_listener.start()  # Запускаем поток записи лога
+    atexit.register(log_listener.stop)  # При выходе записываем оставшиеся в очереди записи лога
+    logging.basicConfig(format='%(message)s',  # В очередь ставим текст сообщения. Дату, источник и уровень добавит формат обработчиков
                         level=logging.INFO,  # Уровень логируемых событий NOTSET/DEBUG/INFO/WARNING/ERROR/CRITICAL
-                        handlers=[logging.FileHandler('Ticker.log', encoding='utf-8'), logging.StreamHandler()])  # Лог записываем в файл и выводим на консоль
-    logging.Formatter.converter = lambda *args: datetime.now(tz=bp_provider.tz_msk).timetuple()  # В логе время указываем по МСК
+                        handlers=[QueueHandler(log_queue)])  # Записи лога только ставим в очередь, не дожидаясь записи в файл и вывода на консоль
+    msk_offset = int(bp_provider.tz_msk.utcoffset(datetime.now()).total_seconds())  # Смещение МСК от UTC в секундах. Постоянное, поэтому вычисляем один раз
+    logging.Formatter.converter = lambda formatter_self, secs: time.gmtime(secs + msk_offset)  # В логе время записи указываем по МСК
 
     datanames = ('TQBR.SBER', 'TQBR.HYDR', get_future_on_date("Si"), get_future_on_date("RI"), 'SPBFUT.CNYRUBF', 'SPBFUT.IMOEXF')  # Кортеж тикеров
 
-    for dataname in datanames:  # Пробегаемся по всем тикерам
-        class_code, ticker = bp_provider.dataname_to_class_code_ticker(dataname)  # Код режима торгов и тикер
-        si = next((instrument for instrument in bp_provider.get_instrument_ticker([ticker]) if instrument['boards'][0]['classCode'] == class_code), None)  # Информация о тикере
+    class_codes_tickers = [get_class_code_ticker(dataname) for dataname in datanames]  # Коды режимов торгов и тикеры
+    instruments = bp_provider.get_instrument_ticker([ticker for _, ticker in class_codes_tickers]) or []  # Информация обо всех тикерах получаем одним запросом
+    si_by_class_code_ticker = {(instrument['boards'][0]['classCode'], instrument['ticker']): instrument for instrument in instruments}  # Информация о тикере по коду режима торгов и тикеру. Справочник строим один раз, чтобы не перебирать инструменты для каждого тикера
+    for class_code, ticker in class_codes_tickers:  # Пробегаемся по всем тикерам
+        si = si_by_class_code_ticker.get((class_code, ticker))  # Информация о тикере из справочника. Если тикер не найден, то None
         if si is None:  # Если тикер не найден
             logger.error(f'Тикер {class_code}.{ticker} не найден')
             continue  # Переходим к следующему тикеру
         logger.info(f'Информация о тикере {class_code}.{ticker} ({si["displayName"]}, {si["instrumentType"]}) на бирже {si["boards"][0]["exchange"]}')
-        logger.info(f'- Лот: {int(float(si["lotSize"]))}')
+        logger.info(f'- Лот: {get_lot_size(si["lotSize"])}')
         logger.info(f'- Шаг цены: {si["minimumStep"]}')
         logger.info(f'- Кол-во десятичных знаков: {si["scale"]}')
     bp_provider.close_web_socket()  # Перед выходом закрываем соединение с WebSocket
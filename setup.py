@@ -7,10 +7,15 @@ setup(name='BCSPy',
       url='https://github.com/cia76/BCSPy',
       packages=find_packages(),
       install_requires=[
+            'orjson',  # Быстрое кодирование/декодирование JSON
             'keyring',  # Безопасное хранение торгового токена
+            'numpy',  # Массивы даты и времени
+            'ijson',  # Потоковый разбор больших ответов JSON
             'requests',  # Запросы/ответы через HTTP API
-            'urllib3',  # Соединение с сервером не установлено за максимальное кол-во попыток подключения
-            'websockets',  # Управление подписками и заявками через WebSocket API
+            'aiohttp',  # Асинхронные запросы/ответы через HTTP API
+            'urllib3',  # Повторные попытки запросов при ошибках соединения и временной недоступности сервера
+            'websockets>=14.0',  # Управление подписками и заявками через WebSocket API
+            'uvloop; sys_platform != "win32"',  # Быстрый цикл событий для подписок WebSocket API. Только для POSIX систем
       ],
       python_requires='>=3.12',
       )